@@ -1,9 +1,19 @@
 import streamlit as st
 import pandas as pd
-import uuid
-import json  # To store lists in the SQL database
+import csv
+import io
+import hmac
+import hashlib
+import os
+import zlib
+import sqlite3
+import threading
+import time
+from contextlib import closing
 from sqlalchemy.exc import OperationalError  # To catch DB errors
 from sqlalchemy import text # Import the text function
+from sqlalchemy import event
+from sqlalchemy.pool import QueuePool
 
 # --- APP CONFIGURATION ---
 st.set_page_config(
@@ -13,20 +23,195 @@ st.set_page_config(
 )
 
 # --- CONSTANTS ---
+DB_URL = "sqlite:///library.db"
 MAX_CHECKOUT_LIMIT = 5
 PLACEHOLDER_COVER_URL = "https://placehold.co/300x400/eeeeee/cccccc?text=No+Cover"
+EXPORT_BATCH_SIZE = 1000
+CATALOG_PAGE_SIZE = 24
+RECENT_TRANSACTIONS_PAGE_SIZE = 10
+MEMBER_PICKER_LIMIT = 50
+MAINTENANCE_INTERVAL_SECONDS = 600
+# Bounds for the version-keyed read caches: old versions and old search/member keys are evicted LRU
+CACHE_MAX_ENTRIES = 4
+KEYED_CACHE_MAX_ENTRIES = 128
+
+# --- SQL STATEMENTS ---
+# Built once at import so reruns reuse the same TextClause (and SQLAlchemy's compiled cache)
+# instead of re-parsing the SQL text on every execution.
+
+SQL_INSERT_BOOK = text(
+    "INSERT INTO books (ISBN, Title, Author, Genre, Total_Quantity, Available, Cover_URL) "
+    "VALUES (:isbn, :title, :author, :genre, :qty, :avail, :url)"
+)
+# Shifts Available by the change in total, so checkouts made after the page loaded are kept;
+# matches nothing (rowcount 0) if the new total is below the copies currently checked out
+SQL_UPDATE_BOOK_QUANTITY = text(
+    "UPDATE books SET Available = Available + (:total - Total_Quantity), Total_Quantity = :total "
+    "WHERE ISBN = :isbn AND :total >= Total_Quantity - Available"
+)
+SQL_DELETE_BOOK_TRANSACTIONS = text("DELETE FROM transactions WHERE ISBN = :isbn")
+# Only removes a book with every copy on the shelf, so no checkouts row (foreign key) can still point at it
+SQL_DELETE_BOOK = text("DELETE FROM books WHERE ISBN = :isbn AND Available = Total_Quantity")
+# Members are never deleted, so the next rowid numbers IDs in sequence after the seeded M-001, M-002
+SQL_REGISTER_MEMBER = text(
+    "INSERT INTO members (Member_ID, Name) "
+    "SELECT printf('M-%03d', COALESCE(MAX(rowid), 0) + 1), :name FROM members "
+    "RETURNING Member_ID"
+)
+SQL_INSERT_USER = text("INSERT INTO users (username, password, role, Member_ID) VALUES (:user, :pass, :role, :member_id)")
+# Inserts nothing (rowcount 0) if the member profile is gone or another account was linked to it meanwhile
+SQL_INSERT_MEMBER_USER = text(
+    "INSERT INTO users (username, password, role, Member_ID) "
+    "SELECT :user, :pass, 'member', Member_ID FROM members WHERE Member_ID = :member_id "
+    "AND NOT EXISTS (SELECT 1 FROM users WHERE Member_ID = :member_id)"
+)
+# Takes SQLite's write lock up front, so a checkout/return can't hit SQLITE_BUSY halfway through
+SQL_BEGIN_IMMEDIATE = text("BEGIN IMMEDIATE")
+SQL_COUNT_MEMBER_CHECKOUTS = text("SELECT COUNT(*) FROM checkouts WHERE Member_ID = :id")
+SQL_MEMBER_CHECKOUTS = text(
+    "SELECT C.ISBN, B.Title, B.Author FROM checkouts C JOIN books B ON B.ISBN = C.ISBN "
+    "WHERE C.Member_ID = :id ORDER BY C.Checked_Out_At"
+)
+# The (Member_ID, ISBN) primary key does the duplicate check: rowcount is 0 if the member already has the book
+SQL_INSERT_CHECKOUT = text("INSERT OR IGNORE INTO checkouts (Member_ID, ISBN) VALUES (:member_id, :isbn)")
+SQL_DELETE_CHECKOUT = text("DELETE FROM checkouts WHERE Member_ID = :member_id AND ISBN = :isbn")
+# The availability guards make these no-ops (rowcount 0) instead of driving the counter out of range
+SQL_DECREMENT_AVAILABLE = text("UPDATE books SET Available = Available - 1 WHERE ISBN = :isbn AND Available > 0")
+SQL_INCREMENT_AVAILABLE = text("UPDATE books SET Available = Available + 1 WHERE ISBN = :isbn AND Available < Total_Quantity")
+SQL_LOG_TRANSACTION = text("INSERT INTO transactions (Member_ID, ISBN, Type) VALUES (:member_id, :isbn, :type)")
+# Seeding is idempotent: rows that already exist (matched on primary key) are left alone
+SQL_SEED_BOOK = text(
+    "INSERT OR IGNORE INTO books (ISBN, Title, Author, Genre, Total_Quantity, Available, Cover_URL) "
+    "VALUES (:isbn, :title, :author, :genre, :qty, :avail, :url)"
+)
+SQL_SEED_MEMBER = text("INSERT OR IGNORE INTO members (Member_ID, Name) VALUES (:id, :name)")
+SQL_SEED_USER = text("INSERT OR IGNORE INTO users (username, password, role, Member_ID) VALUES (:user, :pass, :role, :member_id)")
+SQL_GET_USER = text("SELECT password, role, Member_ID FROM users WHERE username = :username")
+SQL_HAS_USERS = text("SELECT EXISTS (SELECT 1 FROM users)")
+# rowcount is 1 only the first time, for the database that still needs its sample data
+SQL_MARK_SEEDED = text("INSERT OR IGNORE INTO meta (seeded) VALUES (1)")
+SQL_LEGACY_PASSWORDS = text("SELECT username, password FROM users WHERE password NOT LIKE :prefix")
+SQL_COUNT_BOOKS = text("SELECT COUNT(*) FROM books")
+SQL_BOOKS = text("SELECT ISBN, Title, Author, Genre, Total_Quantity, Available FROM books ORDER BY Title")
+SQL_MEMBERS = text("SELECT Member_ID, Name FROM members ORDER BY Name")
+SQL_AVAILABLE_BOOKS = text("SELECT ISBN, Title, Author FROM books WHERE Available > 0 ORDER BY Title")
+# Catalog rows come back as plain tuples in this column order, with the cover fallback already applied
+CATALOG_COLUMNS = "B.Title, B.Author, B.Genre, B.ISBN, B.Total_Quantity, B.Available, COALESCE(NULLIF(B.Cover_URL, ''), :ph) AS Cover_URL"
+SQL_BOOKS_PAGE = text(f"SELECT {CATALOG_COLUMNS} FROM books B ORDER BY B.Title LIMIT :limit OFFSET :offset")
+SQL_COUNT_SEARCH_BOOKS = text("SELECT COUNT(*) FROM books_fts WHERE books_fts MATCH :q")
+SQL_SEARCH_BOOKS_PAGE = text(
+    f"SELECT {CATALOG_COLUMNS} FROM books B JOIN books_fts F ON B.rowid = F.rowid "
+    "WHERE books_fts MATCH :q ORDER BY F.rank LIMIT :limit OFFSET :offset"
+)
+SQL_UPDATE_USER_PASSWORD = text("UPDATE users SET password = :pass WHERE username = :user")
+SQL_USERS = text("SELECT username, role, Member_ID FROM users")
+SQL_UNLINKED_MEMBERS = text(
+    "SELECT M.Member_ID, M.Name FROM members M LEFT JOIN users U ON M.Member_ID = U.Member_ID "
+    "WHERE U.username IS NULL AND M.Name LIKE :prefix ESCAPE '\\' ORDER BY M.Name LIMIT :limit"
+)
+SQL_MEMBER_SUMMARY = text(
+    "SELECT M.Member_ID, M.Name, COUNT(C.ISBN) AS Checked_Out FROM members M "
+    "LEFT JOIN checkouts C ON C.Member_ID = M.Member_ID "
+    "GROUP BY M.Member_ID, M.Name"
+)
+# COALESCE covers SUM() over an empty table
+SQL_DASHBOARD_METRICS = text(
+    "SELECT COALESCE(SUM(Total_Quantity), 0) AS total_books, "
+    "COALESCE(SUM(Available), 0) AS available_books, "
+    "COUNT(*) AS total_titles, "
+    "(SELECT COUNT(*) FROM members) AS total_members "
+    "FROM books"
+)
+# Keyset paging: walks transactions' rowid backwards from the cursor, so older pages cost the same as the first
+SQL_RECENT_TRANSACTIONS = text(
+    "SELECT Transaction_ID, Timestamp, Type, Name, Title FROM transaction_log "
+    "WHERE Transaction_ID < :before ORDER BY Transaction_ID DESC LIMIT :limit"
+)
+SQL_MEMBER_BOOKS = text(
+    "SELECT B.Title, B.Author, COALESCE(NULLIF(B.Cover_URL, ''), :ph) AS Cover_URL FROM checkouts C "
+    "JOIN books B ON B.ISBN = C.ISBN "
+    "WHERE C.Member_ID = :id ORDER BY C.Checked_Out_At"
+)
+SQL_MEMBER_HISTORY = text(
+    "SELECT T.Timestamp, T.Type, B.Title, B.Author FROM transactions T "
+    "JOIN books B ON T.ISBN = B.ISBN "
+    "WHERE T.Member_ID = :id ORDER BY T.Timestamp DESC"
+)
+SQL_TRANSACTION_LOG_PAGE = text(
+    "SELECT Transaction_ID, Timestamp, Type, Member_ID, Name, ISBN, Title FROM transaction_log "
+    "WHERE Transaction_ID > :last_id ORDER BY Transaction_ID LIMIT :limit"
+)
+
+# --- PASSWORD HASHING ---
+# users.password holds 'scrypt$<salt hex>$<digest hex>' rather than the plaintext password.
+
+PASSWORD_SCHEME = "scrypt"
+SCRYPT_PARAMS = {"n": 2**14, "r": 8, "p": 1}
+
+def hash_password(password):
+    """Returns a salted scrypt hash of the password."""
+    salt = os.urandom(16)
+    digest = hashlib.scrypt(password.encode(), salt=salt, **SCRYPT_PARAMS)
+    return f"{PASSWORD_SCHEME}${salt.hex()}${digest.hex()}"
+
+def verify_password(stored_hash, password):
+    """Checks a password against a hash produced by hash_password()."""
+    try:
+        scheme, salt_hex, digest_hex = stored_hash.split("$")
+    except ValueError:
+        return False
+    if scheme != PASSWORD_SCHEME:
+        return False
+    digest = hashlib.scrypt(password.encode(), salt=bytes.fromhex(salt_hex), **SCRYPT_PARAMS)
+    return hmac.compare_digest(digest, bytes.fromhex(digest_hex))
 
 # --- DATABASE CONNECTION & INITIALIZATION ---
 
+# WAL lets readers proceed while a checkout is being written; NORMAL syncs only at WAL checkpoints.
+# All but journal_mode are per-connection settings, so they are applied to every pooled connection.
+SQLITE_PRAGMAS = (
+    "synchronous=NORMAL",
+    "temp_store=MEMORY",
+    "mmap_size=268435456",
+    "cache_size=-20000",
+    "foreign_keys=ON",
+)
+# WAL needs a database file; an in-memory database can only use the 'memory' journal
+if ":memory:" not in DB_URL:
+    SQLITE_PRAGMAS = ("journal_mode=WAL",) + SQLITE_PRAGMAS
+
+def _apply_sqlite_pragmas(dbapi_connection, _connection_record):
+    cursor = dbapi_connection.cursor()
+    for pragma in SQLITE_PRAGMAS:
+        cursor.execute(f"PRAGMA {pragma}")
+    cursor.close()
+
 @st.cache_resource
 def get_db_connection():
     """Returns a connection to the SQLite database."""
-    return st.connection("library_db", type="sql", url="sqlite:///library.db")
+    # Keep a small set of long-lived connections so SQLite's page cache and mmap survive across reruns.
+    # StaticPool would share one connection (and its open transaction) between every user session.
+    connection = st.connection(
+        "library_db",
+        type="sql",
+        url=DB_URL,
+        poolclass=QueuePool,
+        pool_size=5,
+        max_overflow=5,
+        connect_args={"timeout": 30},
+    )
+    event.listen(connection.engine, "connect", _apply_sqlite_pragmas)
+    return connection
 
 conn = get_db_connection()
 
+def insert_books(s, rows):
+    """Inserts book rows (dicts of SQL_INSERT_BOOK params) as one executemany batch."""
+    s.execute(SQL_INSERT_BOOK, rows)
+
+@st.cache_resource(show_spinner=False)
 def initialize_database():
-    """Creates tables if they don't exist and adds sample data."""
+    """Creates tables if they don't exist and adds sample data. Runs once per process, not on every rerun."""
     with conn.session as s:
         # Create books table
         s.execute(text("""
@@ -44,10 +229,39 @@ def initialize_database():
         s.execute(text("""
             CREATE TABLE IF NOT EXISTS members (
                 Member_ID TEXT PRIMARY KEY,
-                Name TEXT,
-                Checked_Out_ISBNs TEXT  -- Storing list as JSON string
+                Name TEXT
+            );
+        """))
+
+        # Create checkouts table: one row per book a member currently has out
+        s.execute(text("""
+            CREATE TABLE IF NOT EXISTS checkouts (
+                Member_ID TEXT,
+                ISBN TEXT,
+                Checked_Out_At DATETIME DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (Member_ID, ISBN),
+                FOREIGN KEY (Member_ID) REFERENCES members(Member_ID),
+                FOREIGN KEY (ISBN) REFERENCES books(ISBN)
             );
         """))
+
+        # Older databases kept each member's checkouts as a JSON list in members.Checked_Out_ISBNs
+        has_json_column = s.execute(text(
+            "SELECT COUNT(*) FROM pragma_table_info('members') WHERE name = 'Checked_Out_ISBNs'"
+        )).scalar()
+        if has_json_column:
+            s.execute(text(
+                "INSERT OR IGNORE INTO checkouts (Member_ID, ISBN) "
+                "SELECT m.Member_ID, j.value FROM members m, json_each(m.Checked_Out_ISBNs) j"
+            ))
+            s.execute(text("ALTER TABLE members DROP COLUMN Checked_Out_ISBNs"))
+
+        # Older quantity updates could store Available as a numpy BLOB; recount it from the checkouts rows
+        s.execute(text(
+            "UPDATE books SET Available = Total_Quantity - "
+            "(SELECT COUNT(*) FROM checkouts c WHERE c.ISBN = books.ISBN) "
+            "WHERE typeof(Available) != 'integer'"
+        ))
         
         # Create users table for login
         s.execute(text("""
@@ -72,60 +286,264 @@ def initialize_database():
                 FOREIGN KEY (ISBN) REFERENCES books(ISBN)
             );
         """))
+
+        # One-row marker set when the sample data is seeded
+        s.execute(text("CREATE TABLE IF NOT EXISTS meta (seeded INTEGER PRIMARY KEY)"))
+
+        # Denormalized log used by the dashboard and the CSV export, so the join is defined once
+        s.execute(text("""
+            CREATE VIEW IF NOT EXISTS transaction_log AS
+            SELECT T.Transaction_ID, T.Timestamp, T.Type, M.Member_ID, M.Name, B.ISBN, B.Title
+            FROM transactions T
+            JOIN members M ON T.Member_ID = M.Member_ID
+            JOIN books B ON T.ISBN = B.ISBN;
+        """))
+
+        # Covering indexes so the view's lookups read Name/Title from the index without touching table rows
+        s.execute(text("CREATE INDEX IF NOT EXISTS idx_members_id_name ON members(Member_ID, Name)"))
+        s.execute(text("CREATE INDEX IF NOT EXISTS idx_books_isbn_title ON books(ISBN, Title)"))
+
+        # A member's history walks their rows newest first instead of sorting; book removal deletes by ISBN.
+        # Recent Transactions pages by Transaction_ID (the rowid), so no index on Timestamp alone is needed.
+        s.execute(text("DROP INDEX IF EXISTS idx_transactions_ts"))
+        s.execute(text("CREATE INDEX IF NOT EXISTS idx_transactions_member_ts ON transactions(Member_ID, Timestamp DESC)"))
+        s.execute(text("CREATE INDEX IF NOT EXISTS idx_transactions_isbn ON transactions(ISBN)"))
+        s.execute(text("CREATE INDEX IF NOT EXISTS idx_users_member ON users(Member_ID)"))
+        # The checkouts primary key leads with Member_ID; this covers the ISBN side (foreign key checks on book delete)
+        s.execute(text("CREATE INDEX IF NOT EXISTS idx_checkouts_isbn ON checkouts(ISBN)"))
+
+        # Pickers: members listed by name, and only books with a copy on the shelf (partial index, read in title order)
+        s.execute(text("CREATE INDEX IF NOT EXISTS idx_members_name ON members(Name)"))
+        s.execute(text("CREATE INDEX IF NOT EXISTS idx_books_available ON books(Title, ISBN, Author, Available) WHERE Available > 0"))
+
+        # Full-text index for catalog search, kept in sync with books by triggers
+        fts_exists = s.execute(text("SELECT COUNT(*) FROM sqlite_master WHERE name = 'books_fts'")).scalar()
+        s.execute(text(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS books_fts "
+            "USING fts5(Title, Author, Genre, content='books', content_rowid='rowid')"
+        ))
+        s.execute(text("""
+            CREATE TRIGGER IF NOT EXISTS books_fts_insert AFTER INSERT ON books BEGIN
+                INSERT INTO books_fts(rowid, Title, Author, Genre) VALUES (new.rowid, new.Title, new.Author, new.Genre);
+            END;
+        """))
+        s.execute(text("""
+            CREATE TRIGGER IF NOT EXISTS books_fts_delete AFTER DELETE ON books BEGIN
+                INSERT INTO books_fts(books_fts, rowid, Title, Author, Genre) VALUES ('delete', old.rowid, old.Title, old.Author, old.Genre);
+            END;
+        """))
+        s.execute(text("""
+            CREATE TRIGGER IF NOT EXISTS books_fts_update AFTER UPDATE OF Title, Author, Genre ON books BEGIN
+                INSERT INTO books_fts(books_fts, rowid, Title, Author, Genre) VALUES ('delete', old.rowid, old.Title, old.Author, old.Genre);
+                INSERT INTO books_fts(rowid, Title, Author, Genre) VALUES (new.rowid, new.Title, new.Author, new.Genre);
+            END;
+        """))
+        if not fts_exists:
+            # Index books that were added before the FTS table existed
+            s.execute(text("INSERT INTO books_fts(books_fts) VALUES ('rebuild')"))
         
-        # Add sample data only if tables are new
+        # Add sample data only to a new database: a warm start is one no-op INSERT OR IGNORE on meta.
+        # A database created before the meta table already has users, so it is only marked, not reseeded.
         try:
-            if s.execute(text("SELECT COUNT(*) FROM books")).scalar() == 0:
-                s.execute(text("INSERT INTO books (ISBN, Title, Author, Genre, Total_Quantity, Available, Cover_URL) VALUES "
-                          "('978-0321765723', 'The Lord of the Rings', 'J.R.R. Tolkien', 'Fantasy', 5, 5, 'https://covers.openlibrary.org/b/id/12838421-L.jpg'),"
-                          "('978-0132354181', 'Clean Code', 'Robert C. Martin', 'Software', 3, 3, 'https://covers.openlibrary.org/b/id/8230017-L.jpg'),"
-                          "('978-0743273565', 'The Great Gatsby', 'F. Scott Fitzgerald', 'Classic', 4, 4, 'https://covers.openlibrary.org/b/id/11181672-L.jpg');"))
-
-            if s.execute(text("SELECT COUNT(*) FROM members")).scalar() == 0:
+            if s.execute(SQL_MARK_SEEDED).rowcount and not s.execute(SQL_HAS_USERS).scalar():
                 member1_id = 'M-001'
                 member2_id = 'M-002'
-                s.execute(
-                    text("INSERT INTO members (Member_ID, Name, Checked_Out_ISBNs) VALUES "
-                         "(:id1, 'Alice Smith', '[]'),"
-                         "(:id2, 'Bob Johnson', '[]');"),
-                    params={"id1": member1_id, "id2": member2_id}
-                )
-
-                if s.execute(text("SELECT COUNT(*) FROM users")).scalar() == 0:
-                    s.execute(text("INSERT INTO users (username, password, role, Member_ID) VALUES "
-                              "('admin', 'admin123', 'admin', NULL),"
-                              "('alice', 'pass123', 'member', :id1),"
-                              "('bob', 'pass456', 'member', :id2);"),
-                              params={"id1": member1_id, "id2": member2_id})
+                s.execute(SQL_SEED_BOOK, [
+                    {"isbn": "978-0321765723", "title": "The Lord of the Rings", "author": "J.R.R. Tolkien", "genre": "Fantasy",
+                     "qty": 5, "avail": 5, "url": "https://covers.openlibrary.org/b/id/12838421-L.jpg"},
+                    {"isbn": "978-0132354181", "title": "Clean Code", "author": "Robert C. Martin", "genre": "Software",
+                     "qty": 3, "avail": 3, "url": "https://covers.openlibrary.org/b/id/8230017-L.jpg"},
+                    {"isbn": "978-0743273565", "title": "The Great Gatsby", "author": "F. Scott Fitzgerald", "genre": "Classic",
+                     "qty": 4, "avail": 4, "url": "https://covers.openlibrary.org/b/id/11181672-L.jpg"},
+                ])
+                s.execute(SQL_SEED_MEMBER, [
+                    {"id": member1_id, "name": "Alice Smith"},
+                    {"id": member2_id, "name": "Bob Johnson"},
+                ])
+                s.execute(SQL_SEED_USER, [
+                    {"user": "admin", "pass": hash_password("admin123"), "role": "admin", "member_id": None},
+                    {"user": "alice", "pass": hash_password("pass123"), "role": "member", "member_id": member1_id},
+                    {"user": "bob", "pass": hash_password("pass456"), "role": "member", "member_id": member2_id},
+                ])
+
+            # Hash any passwords an older database still stores in plaintext
+            legacy_users = s.execute(
+                SQL_LEGACY_PASSWORDS,
+                params={"prefix": f"{PASSWORD_SCHEME}$%"}
+            ).all()
+            if legacy_users:
+                s.execute(SQL_UPDATE_USER_PASSWORD, [
+                    {"user": username, "pass": hash_password(password)} for username, password in legacy_users
+                ])
             
             s.commit()
         except OperationalError as e:
             st.error(f"Error during initialization: {e}")
             s.rollback()
+            # Not cached when it raises, so the next rerun tries again
+            st.stop()
 
 # Run initialization
 initialize_database()
 
+# --- BACKGROUND MAINTENANCE ---
+
+def _run_maintenance(db_path):
+    """Refreshes planner statistics and checkpoints the WAL every MAINTENANCE_INTERVAL_SECONDS.
+    Uses its own sqlite3 connection so it never holds one of the pool's connections."""
+    while True:
+        time.sleep(MAINTENANCE_INTERVAL_SECONDS)
+        try:
+            with closing(sqlite3.connect(db_path, timeout=30, isolation_level=None)) as db:
+                db.execute("ANALYZE")
+                db.execute("PRAGMA wal_checkpoint(PASSIVE)")
+        except sqlite3.Error:
+            pass  # Busy or locked: try again next round
+
+@st.cache_resource
+def start_maintenance():
+    """Starts the maintenance thread once per process; reruns and new sessions get the cached thread."""
+    if ":memory:" in DB_URL:
+        return None
+    thread = threading.Thread(
+        target=_run_maintenance, args=(DB_URL.removeprefix("sqlite:///"),),
+        name="library-db-maintenance", daemon=True
+    )
+    thread.start()
+    return thread
+
+start_maintenance()
+
+# --- CACHED READS ---
+
+@st.cache_resource
+def get_data_versions():
+    """Process-wide write counters per table. Cached reads take one (`version`) or a tuple of them
+    (`versions`) as an argument that is only used as the cache key, so bumping it on commit
+    invalidates them for every session instead of waiting for a TTL."""
+    return {"books": 0, "members": 0, "checkouts": 0, "transactions": 0, "users": 0}
+
+def bump_data_version(*tables):
+    versions = get_data_versions()
+    for table in tables:
+        versions[table] += 1
+
+def data_versions(*tables):
+    """Cache key for a read that joins several tables: changes whenever any of them is written."""
+    versions = get_data_versions()
+    return tuple(versions[table] for table in tables)
+
+@st.cache_data(show_spinner=False, max_entries=CACHE_MAX_ENTRIES)
+def load_books(version):
+    """Returns every book's details and stock, without cover URLs."""
+    return pd.read_sql(SQL_BOOKS, conn.engine)
+
+def build_fts_query(search_query):
+    """Turns free text into an FTS5 query: every word must match as a prefix. Words are quoted so
+    user input can't inject FTS syntax (AND/OR/NEAR, column filters, stray quotes).
+    Search is word-prefix, not substring: the tokenizer drops punctuation, so "C++" searches for words
+    starting with "c". Terms with no letters or digits would match nothing useful and are skipped."""
+    terms = [term for term in search_query.split() if any(ch.isalnum() for ch in term)]
+    return " ".join('"' + term.replace('"', '""') + '"*' for term in terms)
+
+@st.cache_data(show_spinner=False, max_entries=KEYED_CACHE_MAX_ENTRIES)
+def count_catalog(fts_query, version):
+    """Returns how many books match an FTS5 query (all books if it is empty)."""
+    with conn.session as s:
+        if fts_query:
+            return s.execute(SQL_COUNT_SEARCH_BOOKS, params={"q": fts_query}).scalar()
+        return s.execute(SQL_COUNT_BOOKS).scalar()
+
+@st.cache_data(show_spinner=False, max_entries=KEYED_CACHE_MAX_ENTRIES)
+def load_catalog_page(fts_query, page, version):
+    """Returns one page of the catalog: search matches by rank, or every book by title.
+    Only the visible page is read from SQLite."""
+    params = {"limit": CATALOG_PAGE_SIZE, "offset": (page - 1) * CATALOG_PAGE_SIZE, "ph": PLACEHOLDER_COVER_URL}
+    if fts_query:
+        return pd.read_sql(SQL_SEARCH_BOOKS_PAGE, conn.engine, params={"q": fts_query, **params})
+    return pd.read_sql(SQL_BOOKS_PAGE, conn.engine, params=params)
+
+def book_labels(df):
+    """Maps ISBN -> 'Title by Author' for a frame with those columns."""
+    return dict(zip(df['ISBN'], df['Title'] + " by " + df['Author']))
+
+@st.cache_data(show_spinner=False, max_entries=CACHE_MAX_ENTRIES)
+def load_available_book_labels(version):
+    """Returns ISBN -> 'Title by Author' for every book with a copy on the shelf, in title order.
+    The labels are built once per books version instead of on every render."""
+    return book_labels(pd.read_sql(SQL_AVAILABLE_BOOKS, conn.engine))
+
+def load_member_checkouts(member_id):
+    """Returns ISBN, Title and Author of a member's checked out books, oldest first. Read live, it's a primary key range."""
+    return pd.read_sql(SQL_MEMBER_CHECKOUTS, conn.engine, params={"id": member_id})
+
+@st.cache_data(show_spinner=False, max_entries=CACHE_MAX_ENTRIES)
+def load_members(version):
+    """Returns the members table."""
+    return pd.read_sql(SQL_MEMBERS, conn.engine)
+
+@st.cache_data(show_spinner=False, max_entries=CACHE_MAX_ENTRIES)
+def load_dashboard_metrics(versions):
+    """Returns the admin dashboard totals as one row."""
+    return pd.read_sql(SQL_DASHBOARD_METRICS, conn.engine).iloc[0]
+
+@st.cache_data(show_spinner=False, max_entries=KEYED_CACHE_MAX_ENTRIES)
+def load_recent_transactions(before, versions):
+    """Returns one page of transactions older than Transaction_ID `before` (None for the latest), newest first,
+    with member and book names."""
+    params = {"before": before if before is not None else 2**63 - 1, "limit": RECENT_TRANSACTIONS_PAGE_SIZE}
+    return pd.read_sql(SQL_RECENT_TRANSACTIONS, conn.engine, params=params)
+
+@st.cache_data(show_spinner=False, max_entries=KEYED_CACHE_MAX_ENTRIES)
+def load_member_books(member_id, versions):
+    """Returns Title, Author and cover of a member's checked out books."""
+    return pd.read_sql(SQL_MEMBER_BOOKS, conn.engine, params={"id": member_id, "ph": PLACEHOLDER_COVER_URL})
+
+@st.cache_data(show_spinner=False, max_entries=KEYED_CACHE_MAX_ENTRIES)
+def load_member_history(member_id, versions):
+    """Returns a member's transactions, newest first."""
+    return pd.read_sql(SQL_MEMBER_HISTORY, conn.engine, params={"id": member_id})
+
+@st.cache_data(show_spinner=False, max_entries=CACHE_MAX_ENTRIES)
+def load_member_summary(versions):
+    """Returns every member with their checked out count."""
+    return pd.read_sql(SQL_MEMBER_SUMMARY, conn.engine)
+
+@st.cache_data(show_spinner=False, max_entries=KEYED_CACHE_MAX_ENTRIES)
+def load_unlinked_members(name_prefix, versions):
+    """Returns up to MEMBER_PICKER_LIMIT members without a user account whose name starts with `name_prefix`,
+    by name."""
+    escaped = name_prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    params = {"prefix": f"{escaped}%", "limit": MEMBER_PICKER_LIMIT}
+    return pd.read_sql(SQL_UNLINKED_MEMBERS, conn.engine, params=params)
+
+@st.cache_data(show_spinner=False, max_entries=CACHE_MAX_ENTRIES)
+def load_users(version):
+    """Returns the user accounts without password hashes."""
+    return pd.read_sql(SQL_USERS, conn.engine)
+
 # --- AUTHENTICATION ---
 
+@st.cache_data(ttl=60, show_spinner=False)
+def fetch_user(username):
+    """Returns (password hash, role, Member_ID) for a username, or None. Cleared whenever users change."""
+    with conn.session as s:
+        row = s.execute(SQL_GET_USER, params={"username": username}).first()
+    return tuple(row) if row else None
+
 def check_login(username, password):
     """Checks if username and password are correct."""
-    with conn.session as s:
-        result = s.execute(
-            text("SELECT role, Member_ID FROM users "
-            "WHERE username = :username AND password = :password"),
-            params={"username": username, "password": password}
-        ).first()
-        
-        if result:
-            role, member_id = result
-            st.session_state.logged_in = True
-            st.session_state.user_role = role
-            st.session_state.username = username
-            st.session_state.member_id = member_id
-            st.rerun()
-        else:
-            st.error("Incorrect username or password")
+    user = fetch_user(username)
+
+    if user and verify_password(user[0], password):
+        _, role, member_id = user
+        st.session_state.logged_in = True
+        st.session_state.user_role = role
+        st.session_state.username = username
+        st.session_state.member_id = member_id
+        st.rerun()
+    else:
+        st.error("Incorrect username or password")
 
 def show_login_page():
     """Displays the login form."""
@@ -146,6 +564,45 @@ def show_login_page():
 
 # --- PAGE 1: HOME/DASHBOARD ---
 
+TRANSACTION_LOG_HEADERS = ["Transaction_ID", "Timestamp", "Type", "Member_ID", "Name", "ISBN", "Title"]
+
+def iter_transaction_log_csv():
+    """Yields the full transaction log as CSV text, one chunk per keyset-paginated batch."""
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(TRANSACTION_LOG_HEADERS)
+
+    # Seek past the last Transaction_ID seen rather than using OFFSET, so each batch is a rowid
+    # range scan; a short-lived session per batch also avoids holding a read lock for the whole export.
+    last_id = 0
+    while True:
+        with conn.session as s:
+            batch = s.execute(
+                SQL_TRANSACTION_LOG_PAGE,
+                params={"last_id": last_id, "limit": EXPORT_BATCH_SIZE}
+            ).all()
+        # writerows() serialises the whole batch inside the C csv module: one call per batch, not per row
+        writer.writerows(batch)
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+        if len(batch) < EXPORT_BATCH_SIZE:
+            break
+        last_id = batch[-1][0]
+
+def iter_gzip(chunks):
+    """Gzip-compresses an iterable of text chunks incrementally, yielding compressed bytes as they fill."""
+    compressor = zlib.compressobj(wbits=31)  # wbits=31 -> gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode())
+        if data:
+            yield data
+    yield compressor.flush()
+
+def show_transactions_before(transaction_id):
+    """Recent Transactions paging callback: show the page older than `transaction_id`, or the latest for None."""
+    st.session_state.transactions_before = transaction_id
+
 def page_home():
     st.title(f"📚 Welcome, {st.session_state.username}!")
     st.markdown("Welcome to the WorldClass Library Management System.")
@@ -157,16 +614,13 @@ def page_home():
     if st.session_state.user_role == 'admin':
         st.subheader("Admin Dashboard")
         
-        # Fetch metrics
-        total_books_result = conn.query("SELECT SUM(Total_Quantity) FROM books", ttl=5).iloc[0, 0]
-        available_books_result = conn.query("SELECT SUM(Available) FROM books", ttl=5).iloc[0, 0]
-        total_members_result = conn.query("SELECT COUNT(*) FROM members", ttl=5).iloc[0, 0]
-        total_titles_result = conn.query("SELECT COUNT(*) FROM books", ttl=5).iloc[0, 0]
+        # Fetch all metrics in one round-trip
+        metrics = load_dashboard_metrics(data_versions("books", "members"))
 
-        total_books = total_books_result if total_books_result is not None else 0
-        available_books = available_books_result if available_books_result is not None else 0
-        total_members = total_members_result if total_members_result is not None else 0
-        total_titles = total_titles_result if total_titles_result is not None else 0
+        total_books = metrics["total_books"]
+        available_books = metrics["available_books"]
+        total_members = metrics["total_members"]
+        total_titles = metrics["total_titles"]
 
         col1, col2, col3 = st.columns(3)
         col1.metric("Total Book Titles", total_titles)
@@ -175,14 +629,27 @@ def page_home():
         
         st.divider()
         st.subheader("Recent Transactions")
-        transactions_df = conn.query(
-            "SELECT T.Timestamp, T.Type, M.Name, B.Title FROM transactions T "
-            "JOIN members M ON T.Member_ID = M.Member_ID "
-            "JOIN books B ON T.ISBN = B.ISBN "
-            "ORDER BY T.Timestamp DESC LIMIT 10", 
-            ttl=5
-        )
-        st.dataframe(transactions_df, use_container_width=True)
+        before = st.session_state.get("transactions_before")
+        transactions_df = load_recent_transactions(before, data_versions("transactions", "members", "books"))
+        if transactions_df.empty:
+            st.info("No older transactions." if before is not None else "No transactions yet.")
+        else:
+            st.dataframe(transactions_df.drop(columns="Transaction_ID"), use_container_width=True)
+
+        col_latest, col_older = st.columns(2)
+        col_latest.button("Latest", disabled=before is None, on_click=show_transactions_before, args=(None,))
+        has_older = len(transactions_df) == RECENT_TRANSACTIONS_PAGE_SIZE
+        oldest_shown = int(transactions_df["Transaction_ID"].min()) if has_older else None
+        col_older.button("Older", disabled=not has_older, on_click=show_transactions_before, args=(oldest_shown,))
+
+        # Only build the export on demand so the dashboard doesn't scan the whole log on every rerun
+        if st.button("Prepare Transaction Log Export"):
+            st.download_button(
+                "Download transactions.csv.gz",
+                data=b"".join(iter_gzip(iter_transaction_log_csv())),
+                file_name="transactions.csv.gz",
+                mime="application/gzip",
+            )
 
     # Member Dashboard
     if st.session_state.user_role == 'member':
@@ -195,39 +662,21 @@ def page_home():
 
         with tab1:
             st.subheader("Your Checked-Out Books")
-            with conn.session as s:
-                json_isbns = s.execute(
-                    text("SELECT Checked_Out_ISBNs FROM members WHERE Member_ID = :id"),
-                    params={"id": member_id}
-                ).scalar()
-            isbns = json.loads(json_isbns)
+            books_df = load_member_books(member_id, data_versions("checkouts", "books"))
             
-            if not isbns:
+            if books_df.empty:
                 st.info("You have no books checked out. Visit the Book Catalog to find one!")
             else:
-                placeholders = ','.join('?' for _ in isbns)
-                books_df = conn.query(
-                    f"SELECT Title, Author, Cover_URL FROM books WHERE ISBN IN ({placeholders})",
-                    params=isbns,
-                    ttl=5
-                )
-                
                 cols = st.columns(4)
-                for i, row in enumerate(books_df.itertuples()):
+                for i, (title, author, cover_url) in enumerate(books_df.itertuples(index=False, name=None)):
                     with cols[i % 4]:
                         with st.container(border=True):
-                            st.image(row.Cover_URL if row.Cover_URL else PLACEHOLDER_COVER_URL, use_column_width=True)
-                            st.caption(f"**{row.Title}** by {row.Author}")
+                            st.image(cover_url, use_column_width=True)
+                            st.caption(f"**{title}** by {author}")
 
         with tab2:
             st.subheader("Your Past Transactions")
-            history_df = conn.query(
-                "SELECT T.Timestamp, T.Type, B.Title, B.Author FROM transactions T "
-                "JOIN books B ON T.ISBN = B.ISBN "
-                "WHERE T.Member_ID = :id ORDER BY T.Timestamp DESC",
-                params={"id": member_id},
-                ttl=5
-            )
+            history_df = load_member_history(member_id, data_versions("transactions", "books"))
             if history_df.empty:
                 st.info("You have no transaction history.")
             else:
@@ -240,45 +689,44 @@ def page_book_catalog():
     st.title("📖 Book Catalog")
     st.markdown("Browse and search our entire collection.")
 
-    books_df = conn.query("SELECT * FROM books", ttl=5)
+    books_version = get_data_versions()["books"]
     
-    if books_df.empty:
+    if count_catalog("", books_version) == 0:
         st.info("The library catalog is currently empty.")
         return
 
     # --- Search Bar ---
     search_query = st.text_input("Search by Title, Author, or Genre")
+    fts_query = build_fts_query(search_query)
     
-    if search_query:
-        filtered_df = books_df[
-            books_df['Title'].str.contains(search_query, case=False, na=False) |
-            books_df['Author'].str.contains(search_query, case=False, na=False) |
-            books_df['Genre'].str.contains(search_query, case=False, na=False)
-        ]
-    else:
-        filtered_df = books_df
-
-    if filtered_df.empty:
+    match_count = count_catalog(fts_query, books_version)
+    if match_count == 0:
         st.warning("No books found matching your search.")
         return
 
+    # --- Pagination ---
+    page_count = -(-match_count // CATALOG_PAGE_SIZE)
+    page = 1
+    if page_count > 1:
+        page = st.number_input(f"Page (of {page_count})", min_value=1, max_value=page_count, value=1)
+    filtered_df = load_catalog_page(fts_query, page, books_version)
+
     # --- Book Grid Display ---
     cols = st.columns(4)
-    for i, row in enumerate(filtered_df.itertuples()):
+    for i, (title, author, genre, isbn, total, available, cover_url) in enumerate(filtered_df.itertuples(index=False, name=None)):
         with cols[i % 4]:
             with st.container(border=True):
-                cover_url = row.Cover_URL if row.Cover_URL else PLACEHOLDER_COVER_URL
                 st.image(cover_url, use_column_width=True)
-                st.subheader(row.Title)
+                st.subheader(title)
                 
                 with st.expander("Details"):
-                    st.markdown(f"**Author:** {row.Author}")
-                    st.markdown(f"**Genre:** {row.Genre}")
-                    st.markdown(f"**ISBN:** {row.ISBN}")
-                    if row.Available > 0:
-                        st.success(f"**Available:** {row.Available} / {row.Total_Quantity}")
+                    st.markdown(f"**Author:** {author}")
+                    st.markdown(f"**Genre:** {genre}")
+                    st.markdown(f"**ISBN:** {isbn}")
+                    if available > 0:
+                        st.success(f"**Available:** {available} / {total}")
                     else:
-                        st.error(f"**Not Available:** {row.Available} / {row.Total_Quantity}")
+                        st.error(f"**Not Available:** {available} / {total}")
 
 
 # --- PAGE 3: ADMIN PANEL (Admin Only) ---
@@ -306,21 +754,20 @@ def page_admin_panel():
                 submitted = st.form_submit_button("Add Book")
 
                 if submitted:
-                    if not all([isbn, title, author, genre, quantity]):
-                        st.error("Please fill in all required fields.")
+                    isbn, title, author, genre = isbn.strip(), title.strip(), author.strip(), genre.strip()
+                    missing = [name for name, value in (("ISBN", isbn), ("Title", title), ("Author", author), ("Genre", genre)) if not value]
+                    if missing:
+                        st.error(f"Please fill in all required fields. Missing: {', '.join(missing)}")
                     else:
                         try:
                             with conn.session as s:
-                                s.execute(
-                                    text("INSERT INTO books (ISBN, Title, Author, Genre, Total_Quantity, Available, Cover_URL) "
-                                    "VALUES (:isbn, :title, :author, :genre, :qty, :avail, :url)"),
-                                    params={
-                                        "isbn": isbn, "title": title, "author": author, 
-                                        "genre": genre, "qty": quantity, "avail": quantity,
-                                        "url": cover_url if cover_url else None
-                                    }
-                                )
+                                insert_books(s, [{
+                                    "isbn": isbn, "title": title, "author": author, 
+                                    "genre": genre, "qty": quantity, "avail": quantity,
+                                    "url": cover_url.strip() or None
+                                }])
                                 s.commit()
+                                bump_data_version("books")
                             st.success(f"Book '{title}' by {author} added successfully!")
                             st.rerun()
                         except Exception as e:
@@ -328,7 +775,7 @@ def page_admin_panel():
 
         st.divider()
         st.subheader("Existing Books")
-        books_df = conn.query("SELECT * FROM books", ttl=5)
+        books_df = load_books(get_data_versions()["books"])
         st.dataframe(books_df, use_container_width=True)
         
         # Edit/Delete Section
@@ -336,49 +783,68 @@ def page_admin_panel():
         if books_df.empty:
             st.info("No books to manage.")
         else:
+            books_by_isbn = books_df.set_index('ISBN')
             isbn_to_manage = st.selectbox(
                 "Select Book (by ISBN) to Manage", 
                 options=books_df['ISBN'],
-                format_func=lambda x: f"{x} - {books_df.set_index('ISBN').loc[x, 'Title']}"
+                format_func=lambda x: f"{x} - {books_by_isbn.at[x, 'Title']}"
             )
             
             if isbn_to_manage:
-                book_data = books_df.set_index('ISBN').loc[isbn_to_manage]
+                book_data = books_by_isbn.loc[isbn_to_manage]
+                # Plain ints: numpy scalars from the frame must not reach a query parameter
+                total_quantity = int(book_data['Total_Quantity'])
+                available = int(book_data['Available'])
                 
                 col1, col2 = st.columns(2)
                 with col1:
                     st.markdown(f"**Title:** {book_data['Title']}")
-                    checked_out_count = book_data['Total_Quantity'] - book_data['Available']
-                    min_qty = int(checked_out_count) 
                     
                     new_total_quantity = st.number_input(
                         "Update Total Quantity", 
-                        min_value=min_qty,
-                        value=int(book_data['Total_Quantity'])
+                        min_value=total_quantity - available,
+                        value=total_quantity
                     )
                     if st.button("Update Quantity"):
-                        new_available = new_total_quantity - checked_out_count
                         with conn.session as s:
-                            s.execute(
-                                text("UPDATE books SET Total_Quantity = :total, Available = :avail WHERE ISBN = :isbn"),
-                                params={"total": new_total_quantity, "avail": new_available, "isbn": isbn_to_manage}
-                            )
-                            s.commit()
-                        st.success("Quantity updated!")
-                        st.rerun()
+                            s.execute(SQL_BEGIN_IMMEDIATE)
+                            updated = s.execute(
+                                SQL_UPDATE_BOOK_QUANTITY,
+                                params={"total": int(new_total_quantity), "isbn": isbn_to_manage}
+                            ).rowcount
+                            if updated == 1:
+                                s.commit()
+                            else:
+                                s.rollback()
+                            bump_data_version("books")
+                        if updated == 1:
+                            st.success("Quantity updated!")
+                            st.rerun()
+                        else:
+                            st.error("Total quantity can't be less than the copies currently checked out.")
                 
                 with col2:
-                    st.markdown(f"**Available:** {book_data['Available']} / {book_data['Total_Quantity']}")
+                    st.markdown(f"**Available:** {available} / {total_quantity}")
                     if st.button("Remove Book from Library", type="primary"):
-                        if book_data['Available'] < book_data['Total_Quantity']:
+                        if available < total_quantity:
                             st.error("Cannot remove book. Some copies are still checked out.")
                         else:
                             with conn.session as s:
-                                s.execute(text("DELETE FROM transactions WHERE ISBN = :isbn"), params={"isbn": isbn_to_manage})
-                                s.execute(text("DELETE FROM books WHERE ISBN = :isbn"), params={"isbn": isbn_to_manage})
-                                s.commit()
-                            st.success("Book removed!")
-                            st.rerun()
+                                s.execute(SQL_BEGIN_IMMEDIATE)
+                                s.execute(SQL_DELETE_BOOK_TRANSACTIONS, params={"isbn": isbn_to_manage})
+                                # The frame above may be stale: another session can check a copy out after it loaded
+                                removed = s.execute(SQL_DELETE_BOOK, params={"isbn": isbn_to_manage}).rowcount
+                                if removed == 1:
+                                    s.commit()
+                                    bump_data_version("books", "transactions")
+                                else:
+                                    s.rollback()
+                                    bump_data_version("books")
+                            if removed == 1:
+                                st.success("Book removed!")
+                                st.rerun()
+                            else:
+                                st.error("Cannot remove book. Some copies are still checked out.")
 
     # --- Member Management Tab ---
     with tab_members:
@@ -388,14 +854,11 @@ def page_admin_panel():
                 name = st.text_input("Member Name")
                 submitted = st.form_submit_button("Register Member")
                 if submitted and name:
-                    member_id = f"M-{uuid.uuid4().hex[:6].upper()}"
                     try:
                         with conn.session as s:
-                            s.execute(
-                                text("INSERT INTO members (Member_ID, Name, Checked_Out_ISBNs) VALUES (:id, :name, '[]')"),
-                                params={"id": member_id, "name": name}
-                            )
+                            member_id = s.execute(SQL_REGISTER_MEMBER, params={"name": name}).scalar_one()
                             s.commit()
+                            bump_data_version("members")
                         st.success(f"Member '{name}' registered with ID: {member_id}")
                         st.rerun()
                     except Exception as e:
@@ -403,13 +866,15 @@ def page_admin_panel():
 
         st.divider()
         st.subheader("Current Members")
-        members_df = conn.query("SELECT * FROM members", ttl=5)
+        members_df = load_member_summary(data_versions("members", "checkouts"))
         st.dataframe(members_df, use_container_width=True)
         
     # --- User Account Management Tab ---
     with tab_users:
         st.subheader("Manage User Accounts")
         with st.expander("Add New User Account", expanded=False):
+            # Outside the form so typing narrows the member picker right away
+            member_name_prefix = st.text_input("Find member profile by name", key="member_link_filter").strip()
             with st.form("add_user_form", clear_on_submit=True):
                 username = st.text_input("Username")
                 password = st.text_input("Password", type="password")
@@ -417,22 +882,17 @@ def page_admin_panel():
                 
                 member_id_to_link = None
                 if role == 'member':
-                    member_options_df = conn.query(
-                        """
-                        SELECT m.Member_ID, m.Name FROM members m
-                        LEFT JOIN users u ON m.Member_ID = u.Member_ID
-                        WHERE u.username IS NULL
-                        ORDER BY m.Name
-                        """,
-                        ttl=5
-                    )
+                    member_options_df = load_unlinked_members(member_name_prefix, data_versions("members", "users"))
                     if member_options_df.empty:
-                        st.warning("No unlinked member profiles available.")
+                        st.warning("No unlinked member profiles match that name." if member_name_prefix else "No unlinked member profiles available.")
                     else:
+                        if len(member_options_df) == MEMBER_PICKER_LIMIT:
+                            st.caption(f"Showing the first {MEMBER_PICKER_LIMIT} matches; type more of the name to narrow it down.")
+                        name_by_member = dict(zip(member_options_df['Member_ID'], member_options_df['Name']))
                         member_id_to_link = st.selectbox(
                             "Link to Member Profile", 
                             options=member_options_df['Member_ID'],
-                            format_func=lambda x: f"{x} - {member_options_df.set_index('Member_ID').loc[x, 'Name']}"
+                            format_func=lambda x: f"{x} - {name_by_member[x]}"
                         )
                 
                 submitted = st.form_submit_button("Create User")
@@ -445,22 +905,27 @@ def page_admin_panel():
                     else:
                         try:
                             with conn.session as s:
-                                s.execute(
-                                    text("INSERT INTO users (username, password, role, Member_ID) VALUES (:user, :pass, :role, :member_id)"),
+                                created = s.execute(
+                                    SQL_INSERT_MEMBER_USER if role == 'member' else SQL_INSERT_USER,
                                     params={
-                                        "user": username, "pass": password, "role": role, 
+                                        "user": username, "pass": hash_password(password), "role": role, 
                                         "member_id": member_id_to_link
                                     }
-                                )
+                                ).rowcount
                                 s.commit()
-                            st.success(f"User '{username}' created with role '{role}'.")
-                            st.rerun()
+                            if created:
+                                bump_data_version("users")
+                                fetch_user.clear()
+                                st.success(f"User '{username}' created with role '{role}'.")
+                                st.rerun()
+                            else:
+                                st.error("That member profile is no longer available to link. Please pick another.")
                         except Exception as e:
                             st.error(f"Failed to create user. Username may already exist. Error: {e}")
 
         st.divider()
         st.subheader("Existing User Accounts")
-        users_df = conn.query("SELECT username, role, Member_ID FROM users", ttl=5)
+        users_df = load_users(get_data_versions()["users"])
         st.dataframe(users_df, use_container_width=True)
 
 # --- PAGE 4: TRANSACTIONS ---
@@ -468,16 +933,18 @@ def page_admin_panel():
 def page_transactions():
     st.title("🔄 Book Transactions")
 
-    books_df = conn.query("SELECT * FROM books", ttl=5)
-    members_df = conn.query("SELECT * FROM members", ttl=5)
+    versions = get_data_versions()
+    members_df = load_members(versions["members"])
 
-    if books_df.empty or members_df.empty:
+    if members_df.empty or not count_catalog("", versions["books"]):
         st.warning("Please add books and members before managing transactions.")
         return
 
-    # Define a better formatting function for select boxes
+    # Build the select box labels once; format_func runs once per option on every render
+    name_by_member = dict(zip(members_df['Member_ID'], members_df['Name']))
+
     def format_member_name(member_id):
-        return f"{member_id} - {members_df.set_index('Member_ID').loc[member_id, 'Name']}"
+        return f"{member_id} - {name_by_member[member_id]}"
 
     if st.session_state.user_role == 'member':
         st.subheader(f"Transactions for: {st.session_state.username}")
@@ -490,139 +957,142 @@ def page_transactions():
 
 
     col1, col2 = st.columns(2)
-
-    # --- Check Out Section ---
     with col1:
-        st.subheader("Check Out Book")
-        with st.form("checkout_form", clear_on_submit=True):
-            member_id = st.selectbox(
-                "Select Member", 
-                options=member_id_options,
-                format_func=format_member_name
+        checkout_section(member_id_options, format_member_name)
+    with col2:
+        return_section(member_id_options, format_member_name)
+
+# Each section is a fragment: interacting with one reruns only that section, not the whole page.
+# A successful checkout/return calls st.rerun(), which reruns the app so both sections refresh.
+
+@st.fragment
+def checkout_section(member_id_options, format_member_name):
+    st.subheader("Check Out Book")
+    with st.form("checkout_form", clear_on_submit=True):
+        member_id = st.selectbox(
+            "Select Member", 
+            options=member_id_options,
+            format_func=format_member_name
+        )
+        
+        available_labels = load_available_book_labels(get_data_versions()["books"])
+        if not available_labels:
+            st.info("No books are currently available to check out.")
+            isbn = None
+        else:
+            isbn = st.selectbox(
+                "Select Book (Available)", 
+                options=list(available_labels),
+                format_func=available_labels.get
             )
-            
-            available_books_df = books_df[books_df['Available'] > 0]
-            if available_books_df.empty:
-                st.info("No books are currently available to check out.")
-                isbn = None
-            else:
-                isbn = st.selectbox(
-                    "Select Book (Available)", 
-                    options=available_books_df['ISBN'],
-                    format_func=lambda x: f"{available_books_df.set_index('ISBN').loc[x, 'Title']} by {available_books_df.set_index('ISBN').loc[x, 'Author']}"
-                )
-            
-            checkout_submitted = st.form_submit_button("Check Out", type="primary")
-
-            if checkout_submitted and member_id and isbn:
-                with conn.session as s:
-                    json_isbns = s.execute(
-                        text("SELECT Checked_Out_ISBNs FROM members WHERE Member_ID = :id"),
-                        params={"id": member_id}
-                    ).scalar()
-                    isbns = json.loads(json_isbns)
-                    
-                    if isbn in isbns:
-                        st.error("This member already has this book checked out.")
-                    elif len(isbns) >= MAX_CHECKOUT_LIMIT:
-                        st.error(f"Member has reached the checkout limit of {MAX_CHECKOUT_LIMIT} books.")
-                    else:
-                        isbns.append(isbn)
-                        new_json_isbns = json.dumps(isbns)
-                        
-                        s.execute(
-                            text("UPDATE members SET Checked_Out_ISBNs = :json_isbns WHERE Member_ID = :id"),
-                            params={"json_isbns": new_json_isbns, "id": member_id}
-                        )
-                        s.execute(
-                            text("UPDATE books SET Available = Available - 1 WHERE ISBN = :isbn"),
-                            params={"isbn": isbn}
-                        )
-                        s.execute(
-                            text("INSERT INTO transactions (Member_ID, ISBN, Type) VALUES (:member_id, :isbn, 'checkout')"),
-                            params={"member_id": member_id, "isbn": isbn}
-                        )
-                        s.commit()
-                        st.success("Book checked out successfully!")
-                        st.rerun()
+        
+        checkout_submitted = st.form_submit_button("Check Out", type="primary")
 
-    # --- Return Section ---
-    with col2:
-        st.subheader("Return Book")
-        with st.form("return_form", clear_on_submit=True):
-            member_id_return = st.selectbox(
-                "Select Member Returning Book", 
-                options=member_id_options,
-                format_func=format_member_name,
-                key="return_member_select"
+        if checkout_submitted and member_id and isbn:
+            with conn.session as s:
+                s.execute(SQL_BEGIN_IMMEDIATE)
+                inserted = s.execute(
+                    SQL_INSERT_CHECKOUT,
+                    params={"member_id": member_id, "isbn": isbn}
+                ).rowcount
+                
+                if inserted != 1:
+                    s.rollback()
+                    st.error("This member already has this book checked out.")
+                # The count includes the row just inserted
+                elif s.execute(SQL_COUNT_MEMBER_CHECKOUTS, params={"id": member_id}).scalar() > MAX_CHECKOUT_LIMIT:
+                    s.rollback()
+                    st.error(f"Member has reached the checkout limit of {MAX_CHECKOUT_LIMIT} books.")
+                elif s.execute(SQL_DECREMENT_AVAILABLE, params={"isbn": isbn}).rowcount != 1:
+                    s.rollback()
+                    st.error("This book is no longer available.")
+                else:
+                    s.execute(
+                        SQL_LOG_TRANSACTION,
+                        params={"member_id": member_id, "isbn": isbn, "type": "checkout"}
+                    )
+                    s.commit()
+                    bump_data_version("books", "checkouts", "transactions")
+                    st.success("Book checked out successfully!")
+                    st.rerun()
+
+@st.fragment
+def return_section(member_id_options, format_member_name):
+    st.subheader("Return Book")
+    # Outside the form so picking a member refreshes their book list right away
+    member_id_return = st.selectbox(
+        "Select Member Returning Book", 
+        options=member_id_options,
+        format_func=format_member_name,
+        key="return_member_select"
+    )
+    with st.form("return_form", clear_on_submit=True):
+        return_labels = book_labels(load_member_checkouts(member_id_return)) if member_id_return else {}
+        
+        if not return_labels:
+            st.info("This member has no books checked out.")
+            isbn_return = None
+        else:
+            isbn_return = st.selectbox(
+                "Select Book to Return",
+                options=list(return_labels),
+                format_func=return_labels.get
             )
-            
-            books_to_return_options = []
-            if member_id_return:
-                json_isbns_result = conn.query(
-                    "SELECT Checked_Out_ISBNs FROM members WHERE Member_ID = :id",
-                    params={"id": member_id_return},
-                    ttl=5
-                )
-                if not json_isbns_result.empty:
-                    json_isbns = json_isbns_result.iloc[0,0]
-                    books_to_return_options = json.loads(json_isbns)
-            
-            if not books_to_return_options:
-                st.info("This member has no books checked out.")
-                isbn_return = None
-            else:
-                isbn_return = st.selectbox(
-                    "Select Book to Return",
-                    options=books_to_return_options,
-                    format_func=lambda x: f"{books_df.set_index('ISBN').loc[x, 'Title']} by {books_df.set_index('ISBN').loc[x, 'Author']}"
-                )
-            
-            return_submitted = st.form_submit_button("Return Book")
-
-            if return_submitted and member_id_return and isbn_return:
-                with conn.session as s:
-                    json_isbns = s.execute(
-                        text("SELECT Checked_Out_ISBNs FROM members WHERE Member_ID = :id"),
-                        params={"id": member_id_return}
-                    ).scalar()
-                    
-                    isbns = json.loads(json_isbns)
-                    if isbn_return not in isbns:
-                        st.error("Book not found in member's checked out list. Refreshing.")
-                        st.rerun()
-                    else:
-                        isbns.remove(isbn_return)
-                        new_json_isbns = json.dumps(isbns)
-                        
-                        s.execute(
-                            text("UPDATE members SET Checked_Out_ISBNs = :json_isbns WHERE Member_ID = :id"),
-                            params={"json_isbns": new_json_isbns, "id": member_id_return}
-                        )
-                        s.execute(
-                            text("UPDATE books SET Available = Available + 1 WHERE ISBN = :isbn"),
-                            params={"isbn": isbn_return}
-                        )
-                        s.execute(
-                            text("INSERT INTO transactions (Member_ID, ISBN, Type) VALUES (:member_id, :isbn, 'return')"),
-                            params={"member_id": member_id_return, "isbn": isbn_return}
-                        )
-                        s.commit()
-                        st.success("Book returned successfully!")
-                        st.rerun()
+        
+        return_submitted = st.form_submit_button("Return Book")
+
+        if return_submitted and member_id_return and isbn_return:
+            with conn.session as s:
+                s.execute(SQL_BEGIN_IMMEDIATE)
+                deleted = s.execute(
+                    SQL_DELETE_CHECKOUT,
+                    params={"member_id": member_id_return, "isbn": isbn_return}
+                ).rowcount
+                
+                if deleted != 1:
+                    s.rollback()
+                    st.error("Book not found in member's checked out list. Refreshing.")
+                    st.rerun()
+                elif s.execute(SQL_INCREMENT_AVAILABLE, params={"isbn": isbn_return}).rowcount != 1:
+                    s.rollback()
+                    st.error("All copies of this book are already on the shelf.")
+                else:
+                    s.execute(
+                        SQL_LOG_TRANSACTION,
+                        params={"member_id": member_id_return, "isbn": isbn_return, "type": "return"}
+                    )
+                    s.commit()
+                    bump_data_version("books", "checkouts", "transactions")
+                    st.success("Book returned successfully!")
+                    st.rerun()
 
 # --- MAIN APP ROUTER ---
 
-if "logged_in" not in st.session_state:
-    st.session_state.logged_in = False
-    st.session_state.user_role = None
-    st.session_state.username = None
-    st.session_state.member_id = None
-    st.session_state.current_page = "🏠 Home" # Add this line
+SESSION_DEFAULTS = {
+    "logged_in": False,
+    "user_role": None,
+    "username": None,
+    "member_id": None,
+}
+
+# setdefault only fills in missing keys, so this also repairs a partially cleared session
+for key, value in SESSION_DEFAULTS.items():
+    st.session_state.setdefault(key, value)
 
 if not st.session_state.logged_in:
     show_login_page()
 else:
+    # Define pages based on role. st.navigation keeps the page in the URL path, renders only the
+    # selected page, and sends a path this role can't see to the default (Home).
+    pages = [
+        st.Page(page_home, title="Home", icon="🏠", default=True),
+        st.Page(page_book_catalog, title="Book Catalog", icon="📖", url_path="catalog"),
+        st.Page(page_transactions, title="Transactions", icon="🔄", url_path="transactions"),
+    ]
+    if st.session_state.user_role == 'admin':
+        pages.append(st.Page(page_admin_panel, title="Admin Panel", icon="🛡️", url_path="admin"))
+    current_page = st.navigation(pages, position="hidden")
+
     # --- Sidebar Navigation ---
     st.sidebar.title(f"Welcome, {st.session_state.username}!")
     st.sidebar.markdown(f"Role: **{st.session_state.user_role.capitalize()}**")
@@ -635,33 +1105,11 @@ else:
     st.sidebar.divider()
     st.sidebar.header("Navigation")
 
-    # Define pages based on role
-    if st.session_state.user_role == 'admin':
-        PAGES = {
-            "🏠 Home": page_home,
-            "📖 Book Catalog": page_book_catalog,
-            "🔄 Transactions": page_transactions,
-            "🛡️ Admin Panel": page_admin_panel
-        }
-    else:  # 'member'
-        PAGES = {
-            "🏠 Home": page_home,
-            "📖 Book Catalog": page_book_catalog,
-            "🔄 Transactions": page_transactions
-        }
-
-    # Replace radio buttons with modern buttons
-    for page_name, page_fn in PAGES.items():
-        # Add a subtle visual cue for the active page
-        button_type = "primary" if st.session_state.current_page == page_name else "secondary"
-        if st.sidebar.button(page_name, use_container_width=True, type=button_type):
-            st.session_state.current_page = page_name
-            st.rerun() # Rerun to reflect the page change immediately
+    for page in pages:
+        st.sidebar.page_link(page, use_container_width=True)
     
     st.sidebar.divider()
     st.sidebar.info("Made with 📚 Streamlit")
 
     # Display the selected page
-    page_function = PAGES[st.session_state.current_page]
-    page_function()
-
+    current_page.run()